@@ -1,13 +1,22 @@
 import streamlit as st
 import ollama
-import chromadb
-import pdfplumber
-import docx
 import os
 import datetime
-import ast
+import json
 import random
 import re
+import time
+import threading
+import atexit
+import shelve
+import httpx
+import numpy as np
+from collections import OrderedDict, deque
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from file_readers import process_file
+from embed_cache import content_key, quantize_int8, dequantize_int8
+from db import DB_PATH, COLLECTION_NAME, HNSW_PROFILES, DEFAULT_HNSW_PROFILE, DEFAULT_N_RESULTS, hnsw_metadata, get_client, open_chroma_collection, source_model
 
 # --- 1. PAGE CONFIG (MUST BE FIRST) ---
 st.set_page_config(page_title="Gary - STIHL Tech AI", layout="wide")
@@ -20,11 +29,19 @@ st.set_page_config(page_title="Gary - STIHL Tech AI", layout="wide")
 EMBEDDING_MODEL = "all-minilm" 
 PRIMARY_CHAT_MODEL = "gpt-oss:20b"
 FALLBACK_CHAT_MODEL = "llama3.2"
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+EMBED_TIMEOUT = 60 # Big batches on a cold model can take a while
+EMBED_RETRIES = 5 # Attempts per batch, with 1, 2, 4, 8s backoff in between
+
+@st.cache_resource
+def list_ollama_models():
+    """Installed models don't change mid-session; ask Ollama once, not on every rerun."""
+    return [m.get('model', m.get('name')) for m in ollama.list()['models']]
 
 def get_chat_model():
     """Auto-selects the best available chat model so the user doesn't have to."""
     try:
-        models = [m.get('model', m.get('name')) for m in ollama.list()['models']]
+        models = list_ollama_models()
         # 1. Prefer the primary (gpt-oss)
         if any(PRIMARY_CHAT_MODEL in m for m in models):
             return PRIMARY_CHAT_MODEL
@@ -44,12 +61,26 @@ def get_chat_model():
 ACTIVE_CHAT_MODEL = get_chat_model()
 
 # --- CONFIGURATION & SETUP ---
-DB_PATH = "./chroma_db"
 LOG_DIR = "./logs"
 SYSTEM_PROMPT_FILE = "gary_config.txt"
+EMBED_CACHE_PATH = os.path.join(DB_PATH, "embed_cache") # content hash -> vector
+LOG_FLUSH_INTERVAL = 0.5 # Seconds between background log flushes
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 BATCH_SIZE = 50
+EMBED_WORKERS = 4 # Concurrent /api/embed requests during ingestion
+QUERY_CACHE_SIZE = 256 # Opening-question answers remembered per server (LRU)
+QUERY_CACHE_THRESHOLD = 0.95 # Cosine similarity that counts as "the same question"
+CHAT_KEEP_ALIVE = "30m" # Keep the chat model (and its prompt cache) loaded between turns
+REDRAW_INTERVAL = 0.05 # Seconds between live redraws of the streaming answer
+
+# Stream parsing patterns (compiled once, not per token)
+_THINK_START = re.compile(r'^\s*<thinking>')
+_THINK_CLOSE = re.compile(r'</\s*thinking>')
+_THINK_BLOCK = re.compile(r'<thinking>(.*?)</\s*thinking>', re.DOTALL)
+_RAW_TOOL_TEXT = re.compile(r"raw='(.*?)'", re.DOTALL)
+_CLOSE_TAG_OVERLAP = 16 # Re-scan this much old text in case a tag straddles two tokens
+SUGG_MARKER = "<<SUGG>>" # Final line of every answer: <<SUGG>>["...", "...", "..."]
 
 # Ensure directories exist
 if not os.path.exists(DB_PATH):
@@ -57,9 +88,22 @@ if not os.path.exists(DB_PATH):
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
-# Initialize Database
-chroma_client = chromadb.PersistentClient(path=DB_PATH)
-collection = chroma_client.get_or_create_collection(name="enterprise_knowledge_base")
+# Initialize Database (once per server process, not once per rerun)
+@st.cache_resource
+def get_collection():
+    return open_chroma_collection(get_client())
+
+@st.cache_data(ttl=30)
+def get_indexed_sources():
+    """Unique manual names in the DB. collection.get() is O(N), so only refresh every 30s
+    (or when ingest / wipe clears this cache)."""
+    all_data = get_collection().get(include=["metadatas"])
+    if all_data and all_data['metadatas']:
+        return sorted({m['source'] for m in all_data['metadatas']})
+    return []
+
+chroma_client = get_client()
+collection = get_collection()
 
 # --- SESSION LOGGING ---
 def get_session_log_file(first_prompt):
@@ -71,96 +115,200 @@ def get_session_log_file(first_prompt):
         st.session_state.log_filename = os.path.join(LOG_DIR, filename)
     return st.session_state.log_filename
 
+def flush_logs(log_queue):
+    """Drains queued log entries, opening each log file once per flush."""
+    pending = {}
+    while True:
+        # popleft is atomic; a check-then-pop could race the atexit flush at shutdown
+        try:
+            log_file, timestamp, role, content = log_queue.popleft()
+        except IndexError:
+            break
+        pending.setdefault(log_file, []).append(f"[{timestamp}] {role.upper()}: {content}\n" + "-" * 40 + "\n")
+    for log_file, lines in pending.items():
+        with open(log_file, "a", encoding="utf-8", buffering=1 << 16) as f:
+            f.writelines(lines)
+
+def _log_flusher(log_queue):
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL)
+        try:
+            flush_logs(log_queue)
+        except Exception:
+            pass # Never let a bad write kill the flusher
+
+@st.cache_resource
+def get_log_queue():
+    """Process-wide log queue plus the daemon thread that writes it out."""
+    log_queue = deque()
+    threading.Thread(target=_log_flusher, args=(log_queue,), daemon=True).start()
+    atexit.register(flush_logs, log_queue) # Don't lose the tail on shutdown
+    return log_queue
+
 def log_interaction(role, content):
-    """Writes to the session-specific log file."""
+    """Queues a line for the session-specific log file (no disk I/O on the chat path)."""
     log_file = st.session_state.get("log_filename", os.path.join(LOG_DIR, "system_debug.txt"))
     timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-    
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {role.upper()}: {content}\n")
-        f.write("-" * 40 + "\n")
-
-# --- FILE READERS ---
-def read_pdf(file):
-    text_data = []
-    with pdfplumber.open(file) as pdf:
-        for i, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if text:
-                text_data.append({"text": text, "page": i + 1})
-    return text_data
-
-def read_docx(file):
-    doc = docx.Document(file)
-    full_text = []
-    current_chunk = ""
-    page_counter = 1
-    for para in doc.paragraphs:
-        if len(current_chunk) > 1000:
-            full_text.append({"text": current_chunk, "page": page_counter})
-            current_chunk = ""
-            page_counter += 1
-        current_chunk += para.text + "\n"
-    if current_chunk:
-        full_text.append({"text": current_chunk, "page": page_counter})
-    return full_text
-
-def read_txt(file):
-    text = str(file.read(), "utf-8")
-    return [{"text": text, "page": 1}]
-
-def process_file(uploaded_file):
-    if uploaded_file.name.endswith(".pdf"):
-        return read_pdf(uploaded_file)
-    elif uploaded_file.name.endswith(".docx"):
-        return read_docx(uploaded_file)
-    elif uploaded_file.name.endswith((".txt", ".md")):
-        return read_txt(uploaded_file)
-    return []
+    get_log_queue().append((log_file, timestamp, role, content))
 
 # --- CHUNKING & BATCHING ---
 def create_chunks(raw_data, filename):
-    all_chunks = []
+    """Splits every page into overlapping windows.
+    Returns columns {"texts", "sources", "pages"} so batch_insert can slice them directly."""
+    chunks = {"texts": [], "sources": [], "pages": []}
+    step = CHUNK_SIZE - CHUNK_OVERLAP
     for entry in raw_data:
-        text = entry["text"]
-        page = entry["page"]
-        start = 0
-        while start < len(text):
-            end = start + CHUNK_SIZE
-            chunk_text = text[start:end]
-            all_chunks.append({
-                "text": chunk_text,
-                "metadata": {"source": filename, "page": page}
-            })
-            start += CHUNK_SIZE - CHUNK_OVERLAP
-    return all_chunks
+        # Basic hygiene: collapse whitespace runs so we embed (and chunk) less filler
+        text = " ".join(entry["text"].split())
+        starts = range(0, len(text), step)
+        chunks["texts"].extend([text[s : s + CHUNK_SIZE] for s in starts])
+        chunks["sources"].extend([filename] * len(starts))
+        chunks["pages"].extend([entry["page"]] * len(starts))
+    return chunks
+
+@st.cache_resource
+def get_http_client():
+    """One pooled keep-alive client to Ollama per server process (no handshake per embed)."""
+    return httpx.Client(
+        base_url=OLLAMA_URL,
+        timeout=EMBED_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=8),
+    )
+
+@st.cache_resource
+def get_background_pool():
+    """Single worker for speculative work (e.g. pre-embedding suggestion buttons)."""
+    return ThreadPoolExecutor(max_workers=1)
+
+# Worker threads have no Streamlit script context, so the embed helpers take
+# the client as an argument instead of calling get_http_client() themselves.
+def embed_legacy(text, http):
+    """Single-text /api/embeddings call for Ollama builds without /api/embed."""
+    resp = http.post("/api/embeddings", json={"model": EMBEDDING_MODEL, "prompt": text})
+    resp.raise_for_status()
+    return resp.json()["embedding"]
+
+def embed_one(text):
+    """Embeds a single query. Errors propagate so the chat can show them."""
+    http = get_http_client()
+    resp = http.post("/api/embed", json={"model": EMBEDDING_MODEL, "input": text})
+    if resp.status_code != 404:
+        resp.raise_for_status()
+        embeddings = resp.json().get("embeddings")
+        if embeddings:
+            return embeddings[0]
+    return embed_legacy(text, http)
+
+def embed_many_once(docs, http):
+    """Embeds a whole batch in ONE request via Ollama's /api/embed endpoint.
+    Only builds without it (404, or no "embeddings" in the reply) get one call per doc;
+    timeouts and server errors raise so embed_many can back off and retry."""
+    resp = http.post("/api/embed", json={"model": EMBEDDING_MODEL, "input": docs})
+    if resp.status_code != 404:
+        resp.raise_for_status()
+        embeddings = resp.json().get("embeddings")
+        if embeddings is not None:
+            if len(embeddings) != len(docs):
+                raise ValueError(f"/api/embed returned {len(embeddings)} vectors for {len(docs)} docs")
+            return embeddings
+    # STRICT: Always use the embedding model for DB ops
+    return [embed_legacy(doc, http) for doc in docs]
+
+def embed_many(docs, http):
+    """embed_many_once with exponential-backoff retries; raises once every attempt has failed."""
+    if not docs:
+        return []
+    for attempt in range(EMBED_RETRIES):
+        if attempt:
+            time.sleep(2 ** (attempt - 1))
+        try:
+            return embed_many_once(docs, http)
+        except Exception as e:
+            print(f"Embedding attempt {attempt + 1}/{EMBED_RETRIES} failed: {e!r}")
+            if attempt == EMBED_RETRIES - 1:
+                raise
 
 def batch_insert(chunks):
     progress_bar = st.progress(0)
-    for i in range(0, len(chunks), BATCH_SIZE):
-        batch = chunks[i : i + BATCH_SIZE]
-        ids = [f"{item['metadata']['source']}_{i+idx}" for idx, item in enumerate(batch)]
-        docs = [item['text'] for item in batch]
-        metas = [item['metadata'] for item in batch]
-        
-        embeddings = []
-        for doc in docs:
-            try:
-                # STRICT: Always use the embedding model for DB ops
-                res = ollama.embeddings(model=EMBEDDING_MODEL, prompt=doc)
-                embeddings.append(res["embedding"])
-            except:
-                embeddings.append([0]*384) 
-
-        collection.add(ids=ids, embeddings=embeddings, documents=docs, metadatas=metas)
-        
-        # Clamp progress to 1.0 maximum to prevent crash
-        current_progress = (i + BATCH_SIZE) / len(chunks)
-        progress_bar.progress(min(current_progress, 1.0))
+    texts, sources, pages = chunks["texts"], chunks["sources"], chunks["pages"]
+
+    # Same text from the same file always maps to the same id, so re-ingesting
+    # a manual just upserts over itself instead of piling up duplicates.
+    keys = [content_key(text, EMBEDDING_MODEL) for text in texts]
+    # Format each file's id prefix once, not once per chunk
+    prefixes = {source: f"{source}_" for source in set(sources)}
+    models = {source: source_model(source) for source in prefixes} # For db.retrieve()'s pre-filter
+    rows = {}
+    for row, (key, source) in enumerate(zip(keys, sources)):
+        rows.setdefault(prefixes[source] + key, row)
+    ids = list(rows)
+    if len(ids) < len(texts):
+        keep = list(rows.values())
+        texts, sources, pages, keys = ([col[r] for r in keep] for col in (texts, sources, pages, keys))
+
+    starts = range(0, len(ids), BATCH_SIZE)
+    with shelve.open(EMBED_CACHE_PATH) as embed_cache:
+        # Only send text we've never embedded before; each new text is queued once
+        queued = set()
+        to_embed = []
+        for i in starts:
+            docs = []
+            for key, text in zip(keys[i : i + BATCH_SIZE], texts[i : i + BATCH_SIZE]):
+                if key not in embed_cache and key not in queued:
+                    queued.add(key)
+                    docs.append(text)
+            to_embed.append(docs)
+
+        # Keep several embedding requests in flight; results are collected in order
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+            http = get_http_client()
+            futures = [executor.submit(embed_many, docs, http) for docs in to_embed]
+
+            # Chroma's writer isn't thread-safe, so inserts stay on this thread
+            fresh_vectors = {}
+            failed = set() # Keys whose batch ran out of retries; their chunks are skipped
+            for n, (i, future) in enumerate(zip(starts, futures)):
+                j = i + BATCH_SIZE
+                try:
+                    fresh = iter(future.result())
+                except Exception as e:
+                    # Unresolved queued keys in this slice are the ones this batch carried
+                    lost = {key for key in keys[i:j] if key in queued and key not in fresh_vectors}
+                    failed |= lost
+                    fresh = iter(())
+                    st.warning(f"Skipped {len(lost)} chunks: embedding failed after {EMBED_RETRIES} attempts ({e})")
+
+                rows = []
+                embeddings = []
+                for row, key in enumerate(keys[i:j], start=i):
+                    if key in failed:
+                        continue
+                    if key in fresh_vectors:
+                        vector = fresh_vectors[key]
+                    elif key in queued:
+                        vector = fresh_vectors[key] = next(fresh)
+                        embed_cache[key] = quantize_int8(vector)
+                    else:
+                        vector = dequantize_int8(embed_cache[key])
+                    rows.append(row)
+                    embeddings.append(vector)
+
+                if rows:
+                    metas = [{"source": sources[r], "page": pages[r], "model": models[sources[r]]} for r in rows]
+                    collection.upsert(
+                        ids=[ids[r] for r in rows],
+                        embeddings=embeddings,
+                        documents=[texts[r] for r in rows],
+                        metadatas=metas,
+                    )
+
+                # Clamp progress to 1.0 maximum to prevent crash
+                progress_bar.progress(min((n + 1) / len(starts), 1.0))
         
     progress_bar.empty()
 
 # --- LOAD GARY'S BRAIN ---
+@st.cache_data(ttl=300)
 def load_system_prompt():
     if os.path.exists(SYSTEM_PROMPT_FILE):
         with open(SYSTEM_PROMPT_FILE, "r") as f:
@@ -168,6 +316,85 @@ def load_system_prompt():
     else:
         return "You are a helpful assistant."
 
+# Appended to the system message. Keep it static: any per-turn text in the
+# system message would break Ollama's prompt (KV) cache reuse.
+EXECUTION_RULES = """
+### EXECUTION
+1. You are GARY.
+2. FIRST: Start with a `<thinking>` block.
+3. Write a **First-Person Narrative** thought process using **Bold Headers**.
+4. CRITICAL: You MUST close the block with `</thinking>` BEFORE writing your response.
+5. THEN: Provide your response.
+6. FINAL STEP: Generate a list of 3 suggestion buttons.
+   - **CRITICAL PERSPECTIVE RULE:** These buttons are for the **USER** to click. They must be written in the **FIRST PERSON ("I")**.
+   - **Correct:** "I don't have the serial", "Show me the diagram", "I need torque specs".
+   - **Wrong:** "Ask for serial", "Check parts", "User needs help".
+   - Format: the LAST line of your reply is `<<SUGG>>` followed by a JSON array of 3 strings, nothing after it.
+   - Example: <<SUGG>>["Option 1", "Option 2", "Option 3"]
+"""
+
+# --- QUERY CACHE ---
+# Only opening questions are cached: every later answer depends on the conversation
+# so far (and gary_config's step-by-step modes), so replaying one would be wrong.
+@st.cache_resource
+def get_answer_cache():
+    """Opening-question answers shared by every session on this server: (lock, LRU dict)."""
+    return threading.Lock(), OrderedDict()
+
+def query_cache_get(settings, prompt, query_vec=None):
+    """Returns the answer to the same (or a near-identical) opening question asked with
+    the same settings, else None."""
+    lock, qcache = get_answer_cache()
+    with lock:
+        # Exact repeat: plain dict hit, no embedding needed
+        if (settings, prompt) in qcache:
+            qcache.move_to_end((settings, prompt))
+            return qcache[(settings, prompt)]
+        keys = [k for k in qcache if k[0] == settings]
+        if query_vec is None or not keys:
+            return None
+
+        # Semantic repeat: cosine against every cached question in one shot
+        vecs = np.array([qcache[k]["vec"] for k in keys])
+        q = np.asarray(query_vec, dtype=np.float32)
+        sims = vecs @ (q / (np.linalg.norm(q) or 1.0))
+        best = int(np.argmax(sims))
+        if sims[best] > QUERY_CACHE_THRESHOLD:
+            qcache.move_to_end(keys[best])
+            return qcache[keys[best]]
+    return None
+
+def query_cache_put(settings, prompt, query_vec, answer):
+    """Remembers an answer, evicting the least recently used one when full."""
+    lock, qcache = get_answer_cache()
+    q = np.asarray(query_vec, dtype=np.float32)
+    with lock:
+        qcache[(settings, prompt)] = {**answer, "vec": q / (np.linalg.norm(q) or 1.0)}
+        qcache.move_to_end((settings, prompt))
+        while len(qcache) > QUERY_CACHE_SIZE:
+            qcache.popitem(last=False)
+
+# --- SUGGESTION PRE-WARMING ---
+def set_suggestions(suggestions):
+    """Shows the reply buttons and embeds them in the background while the user
+    reads the answer, so clicking one skips the embedding round-trip."""
+    st.session_state.suggestions = suggestions
+    st.session_state.sugg_embeddings = None
+    if suggestions:
+        st.session_state.sugg_embeddings = get_background_pool().submit(embed_many, list(suggestions), get_http_client())
+
+def suggestion_vector(choice):
+    """Pre-computed embedding for a clicked suggestion, or None to embed it live.
+    Never waits: a batch still running (or stuck retrying) is slower than embed_one."""
+    future = st.session_state.get("sugg_embeddings")
+    if future is None or not future.done() or choice not in st.session_state.suggestions:
+        return None
+    try:
+        vector = future.result()[st.session_state.suggestions.index(choice)]
+    except Exception:
+        return None
+    return vector
+
 # --- UI LAYOUT ---
 st.title("🔧 Gary (STIHL NZ Technician)")
 
@@ -184,12 +411,11 @@ with st.sidebar:
     st.divider()
     st.subheader("📚 Library Inspector")
     try:
-        all_data = collection.get()
-        if all_data and all_data['metadatas']:
-            unique_sources = set([m['source'] for m in all_data['metadatas']])
+        unique_sources = get_indexed_sources()
+        if unique_sources:
             st.success(f"Indexed: {len(unique_sources)} Manuals")
             with st.expander("See File List", expanded=True):
-                for s in sorted(unique_sources):
+                for s in unique_sources:
                     st.caption(f"📄 {s}")
         else:
             st.warning("Database is Empty")
@@ -201,27 +427,49 @@ with st.sidebar:
     with st.expander("🛠️ Dev / Debug Console", expanded=False):
         st.caption("Adjust Brain Parameters")
         temp_val = st.slider("Temperature", 0.0, 1.0, 0.1)
-        smart_val = st.select_slider("Retrieval Sensitivity (Chunks)", options=[3, 5, 10, 15, 20], value=10)
+        smart_val = st.select_slider("Retrieval Sensitivity (Chunks)", options=[3, 5, 10, 15, 20], value=DEFAULT_N_RESULTS)
+        hnsw_profile = st.radio("Index Profile", list(HNSW_PROFILES), index=list(HNSW_PROFILES).index(DEFAULT_HNSW_PROFILE), horizontal=True)
+        index_meta = hnsw_metadata(hnsw_profile, smart_val)
+        st.caption(f"HNSW ef_search: {index_meta['hnsw:search_ef']}")
+        search_ef = index_meta["hnsw:search_ef"]
+        # Only ef_search is tunable on a live index (space / M / construction_ef are fixed
+        # at creation), and it lives in the collection configuration, not its metadata.
+        try:
+            if (collection.configuration or {}).get("hnsw", {}).get("ef_search") != search_ef:
+                collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+        except Exception as e: # configuration API is chromadb >= 1.0
+            st.caption(f"ef_search unchanged: {e}")
         show_debug = st.checkbox("Show Raw Context (X-Ray)", value=False)
 
     st.divider()
     if st.button("⚠️ Wipe Memory"):
         try:
-            chroma_client.delete_collection("enterprise_knowledge_base")
+            chroma_client.delete_collection(COLLECTION_NAME)
         except: pass
-        st.session_state.collection = chroma_client.get_or_create_collection("enterprise_knowledge_base")
+        open_chroma_collection(chroma_client, metadata=index_meta)
+        get_collection.clear() # Drop the handle to the deleted collection
+        get_indexed_sources.clear()
+        get_answer_cache.clear() # Cached answers point at wiped pages
         st.rerun()
 
     uploaded_files = st.file_uploader("Upload Manuals", accept_multiple_files=True, type=["pdf", "docx", "txt"])
     if uploaded_files and st.button("Ingest"):
         with st.spinner("Processing..."):
-            all_new_chunks = []
-            for file in uploaded_files:
-                raw = process_file(file)
-                chunks = create_chunks(raw, file.name)
-                all_new_chunks.extend(chunks)
-            if all_new_chunks:
-                batch_insert(all_new_chunks)
+            ingested = 0
+            # Extract every file in its own process (PDF parsing is CPU-bound). "spawn"
+            # keeps the workers clear of the server's threads; they only import file_readers.
+            workers = min(os.cpu_count() or 1, len(uploaded_files))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {pool.submit(process_file, file.name, file.getvalue()): file.name for file in uploaded_files}
+                # Embed each manual as soon as its text is ready while the rest are still parsing
+                for future in as_completed(futures):
+                    chunks = create_chunks(future.result(), futures[future])
+                    if chunks["texts"]:
+                        batch_insert(chunks)
+                        ingested += 1
+            if ingested:
+                get_answer_cache.clear() # New manuals may change old answers
+                get_indexed_sources.clear()
                 st.success("Done!")
                 st.rerun()
 
@@ -262,8 +510,10 @@ if st.session_state.suggestions:
 
 # Input Handling
 prompt = st.chat_input("Talk to Gary...")
+prewarmed_vec = None
 if user_choice:
     prompt = user_choice 
+    prewarmed_vec = suggestion_vector(user_choice)
 
 if prompt:
     # Initialize Log File
@@ -277,17 +527,36 @@ if prompt:
         st.markdown(prompt)
     
     with st.chat_message("assistant"):
+        # 0. QUERY CACHE (skip retrieval + generation for repeated opening questions)
+        cache_settings = (temp_val, smart_val, hnsw_profile)
+        first_turn = len(st.session_state.history) == 1
+        cached = query_cache_get(cache_settings, prompt) if first_turn else None
+        if cached is None:
+            query_vec = prewarmed_vec if prewarmed_vec is not None else embed_one(prompt)
+            if first_turn:
+                cached = query_cache_get(cache_settings, prompt, query_vec)
+        if cached:
+            log_interaction("gary", f"[CACHED]\n[THOUGHTS]: {cached['thinking']}\n[ANSWER]: {cached['content']}")
+            set_suggestions(cached["suggestions"])
+            st.session_state.history.append({
+                "role": "assistant", 
+                "content": cached["content"], 
+                "thinking": cached["thinking"],
+                "debug_context": cached["debug_context"],
+                "sources": cached["sources"]
+            })
+            st.rerun()
+
         # 1. RETRIEVAL (STRICTLY USES EMBEDDING MODEL)
-        query_vec = ollama.embeddings(model=EMBEDDING_MODEL, prompt=prompt)["embedding"]
         results = collection.query(query_embeddings=[query_vec], n_results=smart_val)
+        retrieved_docs, retrieved_metas = results['documents'][0], results['metadatas'][0]
 
         context_text = ""
         sources_used = set()
         debug_snapshots = []
         
-        if results['documents'] and results['documents'][0]:
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i]
+        if retrieved_docs:
+            for doc, meta in zip(retrieved_docs, retrieved_metas):
                 src = f"{meta['source']} (Pg {meta['page']})"
                 sources_used.add(src)
                 context_text += f"\n--- [Source: {src}] ---\n{doc}\n"
@@ -296,34 +565,17 @@ if prompt:
             context_text = "No local manual pages found."
 
         # 2. PROMPT CONSTRUCTION
+        # Most stable content first so Ollama can keep reusing its KV cache:
+        # system rules (byte-identical every turn) -> earlier turns -> this turn's
+        # context + question. Only the tail has to be prefilled each time.
         gary_instructions = load_system_prompt()
-        history_text = "\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in st.session_state.history[-6:]])
-
-        final_system_prompt = f"""
-### SYSTEM INSTRUCTIONS (IMMUTABLE)
-{gary_instructions}
-
-### DATABASE CONTEXT
+        messages = [{"role": "system", "content": f"### SYSTEM INSTRUCTIONS (IMMUTABLE)\n{gary_instructions}\n{EXECUTION_RULES}"}]
+        messages += [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.history[-6:-1]]
+        messages.append({"role": "user", "content": f"""### DATABASE CONTEXT
 {context_text}
 
-### CONVERSATION HISTORY
-{history_text}
-
 ### CURRENT USER INPUT
-{prompt}
-
-### EXECUTION
-1. You are GARY.
-2. FIRST: Start with a `<thinking>` block.
-3. Write a **First-Person Narrative** thought process using **Bold Headers**.
-4. CRITICAL: You MUST close the block with `</thinking>` BEFORE writing your response.
-5. THEN: Provide your response.
-6. FINAL STEP: Generate a `<suggestions>` list of 3 buttons.
-   - **CRITICAL PERSPECTIVE RULE:** These buttons are for the **USER** to click. They must be written in the **FIRST PERSON ("I")**.
-   - **Correct:** "I don't have the serial", "Show me the diagram", "I need torque specs".
-   - **Wrong:** "Ask for serial", "Check parts", "User needs help".
-   - Format: <suggestions>["Option 1", "Option 2", "Option 3"]</suggestions>
-"""
+{prompt}"""})
         
         # 3. STREAM & RENDER (STRICTLY USES CHAT MODEL)
         
@@ -337,54 +589,76 @@ if prompt:
         
         stream = ollama.chat(
             model=ACTIVE_CHAT_MODEL,
-            messages=[{'role': 'user', 'content': final_system_prompt}],
+            messages=messages,
             stream=True,
+            keep_alive=CHAT_KEEP_ALIVE,
             options={"temperature": temp_val}
         )
         
-        full_buffer = ""
+        pieces = [] # Token list, joined on demand (no quadratic += copies)
         is_thinking = False
         captured_thought = ""
+        think_close = None # (start, end) of the first </thinking> once it shows up
+        scanned = 0 # Buffer prefix already searched for </thinking>
+        sugg_scanned = 0 # Buffer prefix already searched for the suggestions marker
+        answer_done = False # True once the suggestions line starts streaming
+        last_draw = 0.0
 
         try:
-            first_chunk = next(stream)['message']['content']
-            full_buffer += first_chunk
+            pieces.append(next(stream)['message']['content'])
         except StopIteration:
             pass
         
         # Check if the buffer "starts" with thinking (ignoring whitespace)
-        if re.match(r'^\s*<thinking>', full_buffer):
+        if pieces and _THINK_START.match(pieces[0]):
             is_thinking = True
 
         try:
             for chunk in stream:
-                token = chunk['message']['content']
-                full_buffer += token
+                pieces.append(chunk['message']['content'])
+                if answer_done:
+                    continue # Only the suggestions JSON is left; nothing more to draw
+
+                # Throttle redraws; the websocket can't show 100 frames a second anyway
+                now = time.monotonic()
+                if now - last_draw < REDRAW_INTERVAL:
+                    continue
+                last_draw = now
+                full_buffer = "".join(pieces)
                 
                 # --- LOGIC: SEPARATE THOUGHTS FROM ANSWER ---
-                
-                if is_thinking:
-                    if "</thinking>" in full_buffer:
-                        is_thinking = False
-                        status_container.update(label="Thought Process Complete", state="complete", expanded=False)
-                        
-                        parts = re.split(r'</\s*thinking>', full_buffer)
-                
-                # Render content (incremental)
-                # ... (this logic continues below, but we need to ensure indentation matches)
-                # Actually, I need to replace the loop carefully.
-                
-                # SIMPLIFIED RENDER LOGIC FOR STABILITY:
-                clean_response = full_buffer
-                created_thought = ""
-
-                if "<thinking>" in full_buffer and "</thinking>" in full_buffer:
-                     parts = re.split(r'</\s*thinking>', full_buffer)
-                     if len(parts) > 1:
-                         created_thought = parts[0].replace("<thinking>", "").strip()
-                         clean_response = parts[1].strip()
-                         if thought_placeholder:
-                             thought_placeholder.markdown(created_thought)
+                # Only the new tail is searched; once found, the offset is kept.
+                if think_close is None:
+                    match = _THINK_CLOSE.search(full_buffer, max(0, scanned - _CLOSE_TAG_OVERLAP))
+                    scanned = len(full_buffer)
+                    if match:
+                        think_close = match.span()
+                        if is_thinking:
+                            is_thinking = False
+                            status_container.update(label="Thought Process Complete", state="complete", expanded=False)
+                        thought_head = full_buffer[:think_close[0]]
+                        if "<thinking>" in thought_head:
+                            thought_placeholder.markdown(thought_head.replace("<thinking>", "").strip())
+                        else:
+                            think_close = None # Stray close tag: keep rendering the raw buffer
+                            scanned = match.end()
+
+                # Look for the suggestions marker in the new tail (never inside the thoughts)
+                marker = -1
+                if not is_thinking:
+                    sugg_from = max(think_close[1] if think_close else 0, sugg_scanned - len(SUGG_MARKER))
+                    marker = full_buffer.find(SUGG_MARKER, sugg_from)
+                    sugg_scanned = len(full_buffer)
+                answer_end = marker if marker != -1 else len(full_buffer)
+
+                clean_response = full_buffer[:answer_end]
+                if think_close:
+                    clean_response = full_buffer[think_close[1]:answer_end].strip()
+
+                if marker != -1:
+                    answer_done = True
+                    response_placeholder.markdown(clean_response)
+                    continue
                                  
                 response_placeholder.markdown(clean_response + "▌")
                 
@@ -393,20 +667,23 @@ if prompt:
             error_str = str(e)
             if "error parsing tool call" in error_str and "raw='" in error_str:
                 # Extract the hidden text that caused the crash
-                match = re.search(r"raw='(.*?)'", error_str, re.DOTALL)
+                match = _RAW_TOOL_TEXT.search(error_str)
                 if match:
                     recovered_text = match.group(1)
-                    full_buffer += recovered_text
+                    pieces.append(recovered_text)
+                    full_buffer = "".join(pieces)
                     # Re-run render logic for the recovered text
                     clean_response = full_buffer
-                    if "<thinking>" in full_buffer and "</thinking>" in full_buffer:
-                         parts = re.split(r'</\s*thinking>', full_buffer)
+                    if "<thinking>" in full_buffer:
+                         parts = _THINK_CLOSE.split(full_buffer)
                          if len(parts) > 1:
                              clean_response = parts[1].strip()
                     response_placeholder.markdown(clean_response)
             else:
                 st.error(f"Stream error: {e}")
 
+        full_buffer = "".join(pieces)
+
         # 4. FINAL CLEANUP
         status_container.update(label="Thought Process Complete", state="complete", expanded=False)
         
@@ -415,21 +692,23 @@ if prompt:
         captured_thought = ""
         
         # Robust Regex Extraction for Final Save
-        think_match = re.search(r'<thinking>(.*?)</\s*thinking>', full_buffer, re.DOTALL)
+        think_match = _THINK_BLOCK.search(full_buffer)
         if think_match:
             captured_thought = think_match.group(1).strip()
-            clean_response = re.split(r'</\s*thinking>', full_buffer)[-1].strip()
+            clean_response = _THINK_CLOSE.split(full_buffer)[-1].strip()
         else:
             clean_response = full_buffer
         
-        # Extract Suggestions
-        sugg_match = re.search(r'<suggestions>(.*?)</suggestions>', clean_response, re.DOTALL)
-        if sugg_match:
+        # Extract Suggestions (trailing marker line; rfind + json.loads both run in C)
+        sugg_idx = clean_response.rfind(SUGG_MARKER)
+        if sugg_idx != -1:
             try:
-                suggestions_found = ast.literal_eval(sugg_match.group(1))
-                clean_response = clean_response.split("<suggestions>")[0].strip()
-            except:
+                parsed = json.loads(clean_response[sugg_idx + len(SUGG_MARKER):].strip())
+                if isinstance(parsed, list):
+                    suggestions_found = [str(s) for s in parsed]
+            except ValueError:
                 pass
+            clean_response = clean_response[:sugg_idx].strip()
         
         # Final Render
         response_placeholder.markdown(clean_response)
@@ -439,12 +718,15 @@ if prompt:
             
         log_interaction("gary", f"[THOUGHTS]: {captured_thought}\n[ANSWER]: {clean_response}")
         
-        st.session_state.suggestions = suggestions_found
-        st.session_state.history.append({
+        set_suggestions(suggestions_found)
+        answer = {
             "role": "assistant", 
             "content": clean_response, 
             "thinking": captured_thought,
             "debug_context": debug_snapshots,
             "sources": list(sources_used)
-        })
+        }
+        st.session_state.history.append(answer)
+        if first_turn:
+            query_cache_put(cache_settings, prompt, query_vec, {**answer, "suggestions": suggestions_found})
         st.rerun()
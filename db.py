@@ -0,0 +1,117 @@
+import os
+import re
+import chromadb
+from functools import lru_cache
+
+# Where the knowledge base lives, which backend holds it and how the Chroma
+# index is built. The CLI scripts (ingest_data, inspect_db, test_retrieval) open
+# the store through here; app.py shares the Chroma path, name and HNSW setup.
+DB_PATH = "./chroma_db"
+SQLITE_PATH = "./kb.db"
+BACKEND = os.environ.get("BACKEND", "chroma") # "chroma" | "sqlite" (sqlite-vec, see sqlite_store.py)
+COLLECTION_NAME = "enterprise_knowledge_base"
+# Saw model numbers in questions and manual file names ("MS661", "MS 661 C-M")
+MODEL_PATTERN = re.compile(r"\bMS\s*-?\s*(\d{3})(?!\d)", re.IGNORECASE)
+
+# HNSW index profiles. M / construction_ef are baked in when the collection is
+# created (or re-created by the app's "Wipe Memory"); search_ef scales with how
+# many chunks each question pulls back, so deeper reads also search wider.
+HNSW_PROFILES = {
+    "fast":       {"M": 12, "construction_ef": 64,  "search_mult": 2},
+    "balanced":   {"M": 16, "construction_ef": 64,  "search_mult": 4},
+    "recall-max": {"M": 32, "construction_ef": 200, "search_mult": 8},
+}
+DEFAULT_HNSW_PROFILE = "balanced"
+DEFAULT_N_RESULTS = 10
+
+def hnsw_metadata(profile=DEFAULT_HNSW_PROFILE, n_results=DEFAULT_N_RESULTS):
+    """Chroma collection metadata for an HNSW profile at a given reading depth."""
+    params = HNSW_PROFILES[profile]
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": params["M"],
+        "hnsw:construction_ef": params["construction_ef"],
+        "hnsw:search_ef": max(n_results * params["search_mult"], n_results),
+    }
+
+@lru_cache(maxsize=1)
+def get_client():
+    return chromadb.PersistentClient(path=DB_PATH)
+
+def open_chroma_collection(client, name=COLLECTION_NAME, metadata=None):
+    """Opens the Chroma collection, creating it with the HNSW build parameters if it's
+    missing. An existing collection is opened as-is, so whichever tool (app or CLI)
+    runs first, the index is built the same way and nobody rewrites its metadata."""
+    try:
+        return client.get_collection(name)
+    except Exception: # NotFoundError (ValueError on older chromadb)
+        return client.create_collection(name, metadata=metadata or hnsw_metadata())
+
+@lru_cache(maxsize=1)
+def get_collection(name=COLLECTION_NAME, dtype="float32"):
+    """Opens (creating if needed) the collection once per process.
+    A one-row read up front pays the store's startup cost here, not in the first query."""
+    if BACKEND == "sqlite":
+        from sqlite_store import SqliteVecCollection
+        collection = SqliteVecCollection(SQLITE_PATH, name=name, dtype=dtype)
+    else:
+        collection = open_chroma_collection(get_client(), name)
+    collection.get(limit=1)
+    return collection
+
+def open_existing_collection(name=COLLECTION_NAME, dtype="float32"):
+    """Read-side open (inspect_db, test_retrieval): raises instead of creating an empty store."""
+    if BACKEND == "sqlite":
+        if not os.path.exists(SQLITE_PATH):
+            raise FileNotFoundError(f"No knowledge base at {SQLITE_PATH} (run ingest_data.py first)")
+        return get_collection(name, dtype)
+    collection = get_client().get_collection(name)
+    collection.get(limit=1)
+    return collection
+
+def delete_collection(name=COLLECTION_NAME):
+    """Drops the collection (ingest --force); the next get_collection() starts empty."""
+    get_collection.cache_clear()
+    _sources.pop(name, None)
+    if BACKEND == "sqlite":
+        if os.path.exists(SQLITE_PATH):
+            os.remove(SQLITE_PATH)
+        return
+    try:
+        get_client().delete_collection(name)
+    except Exception:
+        pass # Nothing to delete on a fresh database
+
+_sources = {} # collection name -> its indexed sources, read once per process
+
+def indexed_sources(collection):
+    """Every source in the collection. sqlite-vec answers from its source index; Chroma
+    has no DISTINCT, so its one full metadata read is kept for the rest of the run."""
+    if hasattr(collection, "sources"):
+        return collection.sources()
+    if collection.name not in _sources:
+        _sources[collection.name] = sorted({m["source"] for m in collection.get(include=["metadatas"])["metadatas"]})
+    return _sources[collection.name]
+
+def source_model(source):
+    """Model number a manual is about, from its file name ("MS 661 - ..." -> "661"), else "".
+    Stored as the chunks' "model" metadata so retrieve() can filter without listing sources."""
+    match = MODEL_PATTERN.search(source)
+    return match.group(1) if match else ""
+
+def retrieve(query, query_embedding, collection, n_results=10, filters=None, **kwargs):
+    """collection.query pre-filtered to the manuals of any model the query names, so the
+    search only covers those chunks; falls back to the whole collection when nothing matches
+    (including stores ingested before chunks carried a "model"). filters is an explicit
+    where clause that replaces the heuristic; kwargs go to query()."""
+    where = filters
+    if where is None:
+        wanted = sorted(set(MODEL_PATTERN.findall(query)))
+        if wanted:
+            where = {"model": {"$in": wanted}}
+
+    if where is not None:
+        results = collection.query(query_embeddings=[query_embedding], n_results=n_results, where=where, **kwargs)
+        if results["ids"][0]:
+            return results
+    return collection.query(query_embeddings=[query_embedding], n_results=n_results, **kwargs)
@@ -0,0 +1,40 @@
+import hashlib
+import numpy as np
+
+# Embedding helpers shared by app.py and the CLI scripts: the cache keys and
+# (int8) cache format, and the precision stored vectors and queries are rounded to.
+
+# Precision vectors are rounded to before storage: "float32" | "float16" | "int8".
+# Queries must go through quantize_embeddings() with the same setting.
+EMBEDDING_DTYPE = "float32"
+
+def content_key(text, model):
+    """Hash of a chunk's text (per embedding model): the cache key, and (after the file name) the DB id."""
+    return hashlib.blake2b(f"{model}:{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+def quantize_int8(vector):
+    """Symmetric int8 quantisation: (scale, 384 bytes) instead of 384 pickled floats."""
+    v = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(v).max()) / 127 or 1.0
+    return scale, np.round(v / scale).astype(np.int8).tobytes()
+
+def dequantize_int8(record):
+    # Entries cached before quantisation are plain float lists
+    if isinstance(record, list):
+        return record
+    scale, data = record
+    return (np.frombuffer(data, dtype=np.int8).astype(np.float32) * scale).tolist()
+
+def quantize_embeddings(embeddings, dtype=EMBEDDING_DTYPE):
+    """L2-normalises each vector and rounds it to `dtype`.
+    int8 uses a per-vector scale (max |v| -> 127), which keeps rankings intact under
+    cosine distance only -- hence the collection is created in cosine space."""
+    arr = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=1, keepdims=True)
+    arr = arr / np.where(norms == 0, 1, norms)
+    if dtype == "float16":
+        return arr.astype(np.float16)
+    if dtype == "int8":
+        scale = 127 / np.maximum(np.abs(arr).max(axis=1, keepdims=True), 1e-12)
+        return np.clip(np.round(arr * scale), -128, 127).astype(np.int8)
+    return arr
@@ -0,0 +1,74 @@
+import io
+import docx
+import fitz # PyMuPDF
+import pdfplumber
+
+# Text extraction for uploaded manuals. Lives outside app.py so a
+# ProcessPoolExecutor can import it in worker processes without dragging
+# Streamlit (and the whole UI script) along. Everything here works on
+# (filename, raw bytes) so the arguments pickle cheaply.
+
+def read_pdf(data, keep=None):
+    """PyMuPDF pulls plain text without pdfplumber's layout pass; pdfplumber is the fallback.
+    keep(text) -> bool drops uninteresting pages up front (search scripts). Under pdfplumber
+    it sees the page's raw characters, so extract_text only runs on pages that pass."""
+    text_data = []
+    has_text = False
+    try:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for i, page in enumerate(doc):
+                text = page.get_text("text")
+                if text.strip():
+                    has_text = True
+                    if keep is None or keep(text):
+                        text_data.append({"text": text, "page": i + 1})
+    except Exception:
+        text_data = [] # Let pdfplumber have a go at PDFs MuPDF chokes on
+        has_text = False
+    if has_text:
+        return text_data
+
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for i, page in enumerate(pdf.pages):
+            if keep is not None and not keep("".join(c["text"] for c in page.chars)):
+                continue
+            text = page.extract_text()
+            if text:
+                text_data.append({"text": text, "page": i + 1})
+    return text_data
+
+def read_pdf_file(path, keep=None):
+    """read_pdf for a PDF on disk (ingest + search scripts)."""
+    with open(path, "rb") as f:
+        return read_pdf(f.read(), keep)
+
+def read_docx(data):
+    doc = docx.Document(io.BytesIO(data))
+    full_text = []
+    current = [] # Paragraphs of the current pseudo-page, joined once when it's emitted
+    current_len = 0
+    page_counter = 1
+    for para in doc.paragraphs:
+        if current_len > 1000:
+            full_text.append({"text": "\n".join(current), "page": page_counter})
+            current = []
+            current_len = 0
+            page_counter += 1
+        current.append(para.text)
+        current_len += len(para.text) + 1
+    if current:
+        full_text.append({"text": "\n".join(current), "page": page_counter})
+    return full_text
+
+def read_txt(data):
+    text = str(data, "utf-8")
+    return [{"text": text, "page": 1}]
+
+def process_file(name, data):
+    if name.endswith(".pdf"):
+        return read_pdf(data)
+    elif name.endswith(".docx"):
+        return read_docx(data)
+    elif name.endswith((".txt", ".md")):
+        return read_txt(data)
+    return []
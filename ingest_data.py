@@ -1,84 +1,265 @@
 import os
-import chromadb
-import ollama
-import pdfplumber
+import argparse
+import shelve
+import asyncio
+import queue
+import threading
+import multiprocessing
+import httpx
+import numpy as np
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from file_readers import read_pdf_file
+from db import get_collection, delete_collection, indexed_sources, source_model
+from embed_cache import EMBEDDING_DTYPE, content_key, quantize_int8, dequantize_int8, quantize_embeddings
 
 # CONFIG
-DB_PATH = "./chroma_db"
+# content hash -> int8 vector, same format as app.py's cache. A separate file:
+# dbm shelves can't take two writers, and the app may be ingesting at the same time.
+EMBED_CACHE_PATH = "./emb_cache"
 DATA_FOLDER = "data"
 EMBEDDING_MODEL = "all-minilm"
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
-BATCH_SIZE = 50
+BATCH_SIZE = 50 # Chunks per embedding request
+ADD_BATCH_SIZE = 5000 # Chunks per collection.upsert (stays under Chroma's max batch size)
+EMBED_TIMEOUT = 60 # Seconds; a 50-chunk batch on a cold model can be slow
+EMBED_RETRIES = 5 # Attempts per batch, with 1, 2, 4, 8s backoff in between
+MAX_PARSE_WORKERS = 4 # PDF parsing processes
+EMBED_CONCURRENCY = 4 # Embedding requests in flight at once
+PIPELINE_DEPTH = 2 # Files buffered between pipeline stages (caps RAM)
 
 # SETUP
-client = chromadb.PersistentClient(path=DB_PATH)
-collection = client.get_or_create_collection(name="enterprise_knowledge_base")
-
-def read_pdf(file_path):
-    text_data = []
-    with pdfplumber.open(file_path) as pdf:
-        for i, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if text:
-                text_data.append({"text": text, "page": i + 1})
-    return text_data
+# The vector store (db.py) is opened in main(): worker processes import this
+# module and must not each open (or inherit) their own handle to the database.
+
+@dataclass
+class Chunks:
+    """One file's chunks as parallel columns; ids and metadata dicts are only built per upsert."""
+    source: str
+    texts: list = field(default_factory=list)
+    pages: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.texts)
 
 def create_chunks(raw_data, filename):
-    all_chunks = []
+    chunks = Chunks(source=filename)
+    step = CHUNK_SIZE - CHUNK_OVERLAP
     for entry in raw_data:
         text = entry["text"]
-        page = entry["page"]
-        start = 0
-        while start < len(text):
-            end = start + CHUNK_SIZE
-            chunk_text = text[start:end]
-            all_chunks.append({
-                "text": chunk_text,
-                "metadata": {"source": filename, "page": page}
-            })
-            start += CHUNK_SIZE - CHUNK_OVERLAP
-    return all_chunks
-
-def batch_insert(chunks):
-    total = len(chunks)
-    print(f"Inserting {total} chunks...")
-    for i in range(0, total, BATCH_SIZE):
-        batch = chunks[i : i + BATCH_SIZE]
-        ids = [f"{item['metadata']['source']}_{i+idx}" for idx, item in enumerate(batch)]
-        docs = [item['text'] for item in batch]
-        metas = [item['metadata'] for item in batch]
-        
-        embeddings = []
-        for doc in docs:
+        starts = range(0, len(text), step)
+        chunks.texts.extend(text[s : s + CHUNK_SIZE] for s in starts)
+        chunks.pages.extend([entry["page"]] * len(starts))
+    return chunks
+
+def parse_file(filename):
+    """Reads + chunks one PDF. Top-level so the process pool can pickle it."""
+    raw_data = read_pdf_file(os.path.join(DATA_FOLDER, filename))
+    return create_chunks(raw_data, filename)
+
+# --- PIPELINE: parse (processes) -> embed (asyncio) -> write (main thread) ---
+# Bounded queues between the stages give backpressure, so PDF parsing, Ollama
+# and Chroma all work at once and a slow stage just stalls the one before it.
+def put_until_stopped(q, item, stop):
+    """q.put that gives up once stop is set, i.e. once the consumer has died."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def parse_stage(files, futures, out_q, stop):
+    for filename, future in zip(files, futures):
+        if stop.is_set():
+            return
+        print(f"Processing {filename}...")
+        try:
+            chunks = future.result()
+        except Exception as e:
+            print(f"Failed to process {filename}: {e}")
+            continue
+        if chunks and not put_until_stopped(out_q, (filename, chunks), stop):
+            return
+    put_until_stopped(out_q, None, stop)
+
+async def embed_legacy(http, docs):
+    """One /api/embeddings call per doc, for Ollama builds without /api/embed."""
+    embeddings = []
+    for doc in docs:
+        resp = await http.post("/api/embeddings", json={"model": EMBEDDING_MODEL, "prompt": doc})
+        resp.raise_for_status()
+        embeddings.append(resp.json()["embedding"])
+    return embeddings
+
+async def embed_once(http, docs):
+    """One batch in one /api/embed request. Only a missing endpoint (404, or no
+    "embeddings" in the reply) drops to the per-doc legacy path; timeouts and
+    server errors raise so embed_batch can back off and retry."""
+    resp = await http.post("/api/embed", json={"model": EMBEDDING_MODEL, "input": docs})
+    if resp.status_code == 404:
+        return await embed_legacy(http, docs)
+    resp.raise_for_status()
+    embeddings = resp.json().get("embeddings")
+    if embeddings is None:
+        return await embed_legacy(http, docs)
+    if len(embeddings) != len(docs):
+        raise ValueError(f"/api/embed returned {len(embeddings)} vectors for {len(docs)} docs")
+    return embeddings
+
+async def embed_batch(http, limit, docs):
+    """embed_once with exponential-backoff retries; returns None once every attempt has failed."""
+    for attempt in range(EMBED_RETRIES):
+        if attempt:
+            await asyncio.sleep(2 ** (attempt - 1)) # Outside the semaphore: let healthy batches run
+        async with limit:
             try:
-                res = ollama.embeddings(model=EMBEDDING_MODEL, prompt=doc)
-                embeddings.append(res["embedding"])
+                return await embed_once(http, docs)
             except Exception as e:
-                print(f"Embedding error: {e}")
-                embeddings.append([0]*384) 
+                print(f"Embedding attempt {attempt + 1}/{EMBED_RETRIES} failed: {e!r}")
+    return None
+
+async def embed_files(in_q, out_q):
+    # One keep-alive client for the whole run; the semaphore (not the pool)
+    # bounds concurrency so queued batches don't hit httpx's pool timeout.
+    limit = asyncio.Semaphore(EMBED_CONCURRENCY)
+    async with httpx.AsyncClient(
+        base_url=OLLAMA_URL,
+        timeout=EMBED_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=EMBED_CONCURRENCY),
+    ) as http:
+        with shelve.open(EMBED_CACHE_PATH) as embed_cache:
+            while (item := await asyncio.to_thread(in_q.get)) is not None:
+                filename, chunks = item
+                try:
+                    # Repeated headers / footers and re-ingested manuals come out of the
+                    # cache; only text we've never embedded goes to Ollama, once.
+                    keys = [content_key(text, EMBEDDING_MODEL) for text in chunks.texts]
+                    vectors = {}
+                    misses = {}
+                    for key, text in zip(keys, chunks.texts):
+                        if key in vectors or key in misses:
+                            continue
+                        cached = embed_cache.get(key)
+                        if cached is None:
+                            misses[key] = text
+                        else:
+                            vectors[key] = dequantize_int8(cached)
+
+                    miss_keys = list(misses)
+                    docs = list(misses.values())
+                    print(f"Embedding {len(docs)} of {len(keys)} chunks from {filename}...")
+                    starts = range(0, len(docs), BATCH_SIZE)
+                    results = await asyncio.gather(*(embed_batch(http, limit, docs[i : i + BATCH_SIZE]) for i in starts))
+                    failed = 0
+                    for i, batch in zip(starts, results):
+                        batch_keys = miss_keys[i : i + BATCH_SIZE]
+                        if batch is None:
+                            failed += len(batch_keys)
+                            continue
+                        for key, vec in zip(batch_keys, batch):
+                            vectors[key] = vec
+                            embed_cache[key] = quantize_int8(vec)
+                    if failed:
+                        # Nothing of this file is written, so the next run picks it up again
+                        # (and gets the batches that did succeed from the cache).
+                        print(f"Skipping {filename}: {failed} chunks could not be embedded")
+                        continue
+
+                    embeddings = [vectors[key] for key in keys]
+                    await asyncio.to_thread(out_q.put, (filename, chunks, keys, quantize_embeddings(embeddings).tolist()))
+                except Exception as e:
+                    print(f"Failed to embed {filename}: {e}")
 
-        collection.add(ids=ids, embeddings=embeddings, documents=docs, metadatas=metas)
-        print(f"Inserted batch {i//BATCH_SIZE + 1}/{(total // BATCH_SIZE) + 1}")
+def embed_stage(in_q, out_q, stop):
+    try:
+        asyncio.run(embed_files(in_q, out_q))
+    except Exception as e:
+        print(f"Embedding stage failed: {e}")
+    finally:
+        # Normally a no-op (parsing is done); if this stage died early it
+        # unblocks parse_stage so the run ends instead of hanging.
+        stop.set()
+        out_q.put(None)
+
+def batch_insert(collection, chunks, keys, embeddings):
+    id_prefix = f"{chunks.source}_"
+    model = source_model(chunks.source) # For retrieve()'s model pre-filter
+
+    # Same ids as app.py (file + content hash), upserted: a manual ingested here and
+    # uploaded in the app (or vice versa) lands on the same rows instead of twice.
+    # Repeated text within the file collapses onto its first occurrence.
+    rows = {}
+    for row, key in enumerate(keys):
+        rows.setdefault(id_prefix + key, row)
+    ids = list(rows)
+    keep = list(rows.values())
+    total = len(ids)
+
+    # One upsert for the whole file amortises Chroma's per-call index overhead;
+    # only really big manuals get split to cap the memory spike.
+    for i in range(0, total, ADD_BATCH_SIZE):
+        picked = keep[i : i + ADD_BATCH_SIZE]
+        collection.upsert(
+            ids=ids[i : i + ADD_BATCH_SIZE],
+            embeddings=[embeddings[r] for r in picked],
+            documents=[chunks.texts[r] for r in picked],
+            metadatas=[{"source": chunks.source, "page": chunks.pages[r], "model": model} for r in picked],
+        )
+    print(f"Inserted {total} chunks")
 
 def main():
+    parser = argparse.ArgumentParser(description="Ingest the PDFs in data/ into the knowledge base.")
+    parser.add_argument("--force", action="store_true", help="clear the collection and re-ingest every PDF")
+    args = parser.parse_args()
+
     if not os.path.exists(DATA_FOLDER):
         print("Data folder not found!")
         return
 
+    if args.force:
+        delete_collection()
+    collection = get_collection(dtype=EMBEDDING_DTYPE)
+    # One metadata read for the whole run; files already in the store are skipped
+    existing = set(indexed_sources(collection))
+
     files = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".pdf")]
-    print(f"Found {len(files)} PDFs.")
+    new_files = [f for f in files if f not in existing]
+    print(f"Found {len(files)} PDFs ({len(files) - len(new_files)} already ingested).")
+    files = new_files
+    if not files:
+        return
 
-    for filename in files:
-        print(f"Processing {filename}...")
-        file_path = os.path.join(DATA_FOLDER, filename)
-        try:
-            raw_data = read_pdf(file_path)
-            chunks = create_chunks(raw_data, filename)
-            batch_insert(chunks)
-            print(f"Done: {filename}")
-        except Exception as e:
-            print(f"Failed to process {filename}: {e}")
+    # Parse PDFs in parallel processes; inserts stay here in the main process.
+    # "spawn" workers start clean, so they never inherit the open Chroma client.
+    workers = min(os.cpu_count() or 1, MAX_PARSE_WORKERS)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(parse_file, filename) for filename in files]
+
+        parsed_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+        embedded_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+        stop = threading.Event()
+        stages = [
+            threading.Thread(target=parse_stage, args=(files, futures, parsed_q, stop), daemon=True),
+            threading.Thread(target=embed_stage, args=(parsed_q, embedded_q, stop), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        for filename, chunks, keys, embeddings in iter(embedded_q.get, None):
+            try:
+                batch_insert(collection, chunks, keys, embeddings)
+                print(f"Done: {filename}")
+            except Exception as e:
+                print(f"Failed to insert {filename}: {e}")
+
+        for stage in stages:
+            stage.join()
+        # After an early stop, don't sit parsing files nobody will embed
+        pool.shutdown(cancel_futures=True)
 
 if __name__ == "__main__":
     main()
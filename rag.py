@@ -1,12 +1,21 @@
 import os
 import ollama
 import chromadb
+import numpy as np
+from functools import lru_cache
 from pypdf import PdfReader
+from db import retrieve, source_model
 
 # --- CONFIGURATION ---
 DATA_FOLDER = "data"
 EMBEDDING_MODEL = "all-minilm"
 LLM_MODEL = "llama3.2"
+EMBED_TIMEOUT = 60 # Seconds; a whole file goes to Ollama in one request
+FETCH_K = 20 # Candidates pulled from the collection
+TOP_K = 5 # Chunks kept after MMR reranking
+MMR_LAMBDA = 0.5 # 1.0 = pure relevance, 0.0 = pure diversity
+
+ollama_client = ollama.Client(timeout=EMBED_TIMEOUT)
 
 # 1. THE LIBRARIAN (File Readers)
 def read_text_file(file_path):
@@ -20,6 +29,42 @@ def read_pdf_file(file_path):
         text += page.extract_text() + "\n"
     return text
 
+def embed_chunks(chunks):
+    """All of a file's chunks in one /api/embed call (per-chunk fallback for older Ollama)."""
+    try:
+        return ollama_client.embed(model=EMBEDDING_MODEL, input=chunks)["embeddings"]
+    except Exception:
+        return [ollama_client.embeddings(model=EMBEDDING_MODEL, prompt=chunk)["embedding"] for chunk in chunks]
+
+@lru_cache(maxsize=1024)
+def embed_query(model, prompt):
+    """Query embeddings are memoised: asking the same thing twice skips Ollama."""
+    return tuple(ollama_client.embeddings(model=model, prompt=prompt)["embedding"])
+
+def mmr(query_vec, embeddings, k=TOP_K, lam=MMR_LAMBDA):
+    """Maximal Marginal Relevance: indices of k candidates that are relevant to the
+    query but not redundant with each other. All cosines are computed up front."""
+    E = np.asarray(embeddings, dtype=np.float32)
+    E /= np.linalg.norm(E, axis=1, keepdims=True) + 1e-12
+    q = np.asarray(query_vec, dtype=np.float32)
+    q /= np.linalg.norm(q) + 1e-12
+    sims = E @ q
+    pair = E @ E.T
+
+    k = min(k, len(E))
+    selected = [int(np.argmax(sims))]
+    redundancy = pair[:, selected[0]].copy() # Max similarity to anything already picked
+    mask = np.zeros(len(E), dtype=bool)
+    mask[selected[0]] = True
+    while len(selected) < k:
+        scores = lam * sims - (1 - lam) * redundancy
+        scores[mask] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        mask[best] = True
+        np.maximum(redundancy, pair[:, best], out=redundancy)
+    return selected
+
 def chunk_text(text, chunk_size=500):
     # Simple chunker: splits text into blocks of ~500 characters
     # In a pro app, you'd use smarter splitters (by paragraph, sentence, etc.)
@@ -67,18 +112,19 @@ for filename in files:
 
     # Chunk and Store
     chunks = chunk_text(text_content)
-    for i, chunk in enumerate(chunks):
-        # We embed the chunk
-        response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=chunk)
-        embedding = response["embedding"]
-        
-        # We store it with metadata (so we know which file it came from)
-        collection.add(
-            ids=[f"{filename}_{i}"],
-            embeddings=[embedding],
-            documents=[chunk],
-            metadatas=[{"source": filename}]
-        )
+    if not chunks:
+        continue
+
+    # We embed every chunk of the file in one go
+    embeddings = embed_chunks(chunks)
+
+    # We store them with metadata (so we know which file each came from)
+    collection.add(
+        ids=[f"{filename}_{i}" for i in range(len(chunks))],
+        embeddings=embeddings,
+        documents=chunks,
+        metadatas=[{"source": filename, "model": source_model(filename)}] * len(chunks)
+    )
     print(f"Processed: {filename} ({len(chunks)} chunks)")
     doc_count += 1
 
@@ -91,17 +137,26 @@ while True:
         break
 
     # Retrieve
-    response = ollama.embeddings(model=EMBEDDING_MODEL, prompt=user_query)
-    query_embedding = response["embedding"]
+    query_embedding = list(embed_query(EMBEDDING_MODEL, user_query))
 
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=3 # Get top 3 chunks for better context
+    results = retrieve(
+        user_query,
+        query_embedding,
+        collection,
+        n_results=FETCH_K, # Over-fetch, then let MMR pick a diverse top 5
+        include=["embeddings", "documents", "metadatas"]
     )
-    
+    if not results['documents'][0]:
+        print("Nothing relevant found.")
+        continue
+
+    picks = mmr(query_embedding, results['embeddings'][0])
+    docs = results['documents'][0]
+    metas = results['metadatas'][0]
+
     # Combine retrieved chunks
-    retrieved_text = "\n".join(results['documents'][0])
-    sources = set(meta['source'] for meta in results['metadatas'][0])
+    retrieved_text = "\n".join(docs[i] for i in picks)
+    sources = set(metas[i]['source'] for i in picks)
 
     print(f"Reading from: {', '.join(sources)}...\n")
 
@@ -1,8 +1,25 @@
 import os
-import pdfplumber
+from concurrent.futures import ProcessPoolExecutor
+from file_readers import read_pdf_file
 
 DATA_FOLDER = "data"
 SEARCH_TERM = "11448932400" # Press sleeve from old log
+MAX_WORKERS = 4 # PDF parsing processes
+
+def has_search_term(text):
+    """Page gate for read_pdf_file (checked before pdfplumber's layout pass)."""
+    return SEARCH_TERM in text
+
+def search_file(filename):
+    """Scans one PDF. Returns [(page_no, snippet), ...] so the parent prints in order."""
+    matches = []
+    path = os.path.join(DATA_FOLDER, filename)
+    for entry in read_pdf_file(path, keep=has_search_term):
+        text = entry["text"]
+        idx = text.find(SEARCH_TERM) # One scan for both the test and the snippet
+        if idx != -1:
+            matches.append((entry["page"], text[max(0, idx - 50) : idx + 100]))
+    return matches
 
 def search_in_pdfs():
     print(f"Searching for '{SEARCH_TERM}' in {DATA_FOLDER}...")
@@ -13,18 +30,18 @@ def search_in_pdfs():
     files = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".pdf")]
     found = False
     
-    for filename in files:
-        path = os.path.join(DATA_FOLDER, filename)
-        try:
-            with pdfplumber.open(path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text()
-                    if text and SEARCH_TERM in text:
-                        print(f"FOUND in: {filename} (Page {i+1})")
-                        print(f"Content snippet: {text[text.find(SEARCH_TERM)-50 : text.find(SEARCH_TERM)+100]}")
-                        found = True
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, MAX_WORKERS)) as pool:
+        futures = [pool.submit(search_file, filename) for filename in files]
+        for filename, future in zip(files, futures):
+            try:
+                matches = future.result()
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                continue
+            for page_no, snippet in matches:
+                print(f"FOUND in: {filename} (Page {page_no})")
+                print(f"Content snippet: {snippet}")
+                found = True
             
     if not found:
         print("Not found in any PDF.")
@@ -1,15 +1,40 @@
 import os
-import pdfplumber
 import re
+from concurrent.futures import ProcessPoolExecutor
+from file_readers import read_pdf_file
+try:
+    import re2 as regex_engine # google-re2: linear-time matching, no backtracking
+except ImportError:
+    regex_engine = re
 
 DATA_FOLDER = "data"
+MAX_WORKERS = 4 # PDF parsing processes
+
+# Regex for Stihl part numbers (e.g., 1144 030 2000 or 1144-030-2000 or 11440302000)
+# They usually start with 1144 for MS661. Compiled once per process at import (each worker, not each page).
+PART_PATTERN = regex_engine.compile(r"1144[\s\-\.]?\d{3}[\s\-\.]?\d{4}")
+
+def search_file(filename):
+    """Scans one PDF. Returns [(page_no, part_numbers, context), ...] so the parent prints in order."""
+    results = []
+    path = os.path.join(DATA_FOLDER, filename)
+    for entry in read_pdf_file(path):
+        text = entry["text"]
+        lower = text.lower() # Lowercased once per page
+        # Check for Piston keyword
+        idx = lower.find("piston")
+        if idx != -1:
+            # Look for part numbers nearby
+            matches = PART_PATTERN.findall(text)
+            if matches:
+                # Grab context
+                start = max(0, idx - 50)
+                end = min(len(text), idx + 100)
+                results.append((entry["page"], matches, text[start:end].replace(chr(10), ' ')))
+    return results
 
 def search_piston_parts():
     print(f"Searching for 'Piston' and Part Numbers (1144...) in {DATA_FOLDER}...")
-    
-    # Regex for Stihl part numbers (e.g., 1144 030 2000 or 1144-030-2000 or 11440302000)
-    # They usually start with 1144 for MS661
-    part_pattern = re.compile(r"1144[\s\-\.]?\d{3}[\s\-\.]?\d{4}")
 
     if not os.path.exists(DATA_FOLDER):
         print("Data folder missing.")
@@ -17,27 +42,18 @@ def search_piston_parts():
 
     files = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".pdf")]
     
-    for filename in files:
-        path = os.path.join(DATA_FOLDER, filename)
-        try:
-            with pdfplumber.open(path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text()
-                    if text:
-                        # Check for Piston keyword
-                        if "piston" in text.lower():
-                            # Look for part numbers nearby
-                            matches = part_pattern.findall(text)
-                            if matches:
-                                print(f"FOUND Piston Candidate in: {filename} (Page {i+1})")
-                                print(f"Matches: {matches}")
-                                # Print context
-                                idx = text.lower().find("piston")
-                                start = max(0, idx - 50)
-                                end = min(len(text), idx + 100)
-                                print(f"Context: ...{text[start:end].replace(chr(10), ' ')}...\n")
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, MAX_WORKERS)) as pool:
+        futures = [pool.submit(search_file, filename) for filename in files]
+        for filename, future in zip(files, futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                continue
+            for page_no, matches, context in results:
+                print(f"FOUND Piston Candidate in: {filename} (Page {page_no})")
+                print(f"Matches: {matches}")
+                print(f"Context: ...{context}...\n")
 
 if __name__ == "__main__":
     search_piston_parts()
@@ -1,15 +1,54 @@
 import os
-import pdfplumber
 import re
+from concurrent.futures import ProcessPoolExecutor
+from file_readers import read_pdf_file
+try:
+    import re2 as regex_engine # google-re2: linear-time matching, no backtracking
+except ImportError:
+    regex_engine = re
 
 DATA_FOLDER = "data"
 # The number user is asking for: 1144 020 1202
 # We'll search for the raw digits "11440201202" in the text (ignoring spaces/dashes)
 TARGET_DIGITS = "11440201202"
+TARGET_TEXT = "1144 020 1202" # As printed in the parts lists
+MAX_WORKERS = 4 # PDF parsing processes
+# Any spelling of the part number ("1144 020 1202", "1144-020-1202", ...), compiled once
+PART_PATTERN = regex_engine.compile(r"1144[\s\-\.]?020[\s\-\.]?1202")
+# Every byte except ASCII 0-9, for bytes.translate(None, ...) to delete
+_NON_DIGITS = bytes(c for c in range(256) if not 48 <= c <= 57)
 
 def clean_text(text):
-    """Remove all non-digit characters."""
-    return re.sub(r'[^0-9]', '', text)
+    """Remove all non-digit characters (a C-level table scan, no regex)."""
+    return text.encode("ascii", "ignore").translate(None, _NON_DIGITS).decode("ascii")
+
+def has_target_digits(text):
+    """Page gate for read_pdf_file: a direct or fuzzy hit implies the flattened digits match."""
+    return TARGET_DIGITS in clean_text(text)
+
+def search_file(filename):
+    """Scans one PDF. Returns [(page_no, kind, actual_text, context), ...] so the parent prints in order."""
+    hits = []
+    path = os.path.join(DATA_FOLDER, filename)
+    for entry in read_pdf_file(path, keep=has_target_digits):
+        text = entry["text"]
+        page_no = entry["page"]
+        # 1. Direct string match (e.g. "1144 020 1202")
+        context = get_context(text, TARGET_TEXT) # None unless the exact string is on the page
+        if context:
+            hits.append((page_no, "DIRECT", None, context))
+        
+        # 2. Flattened match (e.g. "11440201202" or "1144-020-1202")
+        flat_text = clean_text(text)
+        if TARGET_DIGITS in flat_text:
+            # If we found it in flattened text but not direct, try to find the actual representation
+            # This is tricky, just printing a chunk of the page might be best or a regex search
+            match = PART_PATTERN.search(text)
+            if match:
+                hits.append((page_no, "FUZZY", match.group(0), get_context(text, match.group(0))))
+            else:
+                hits.append((page_no, "FUZZY", None, None))
+    return hits
 
 def search_files():
     print(f"Searching for {TARGET_DIGITS} (flexible format) in {DATA_FOLDER}...")
@@ -21,46 +60,34 @@ def search_files():
     files = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".pdf")]
     found = False
     
-    for filename in files:
-        path = os.path.join(DATA_FOLDER, filename)
-        try:
-            with pdfplumber.open(path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    text = page.extract_text()
-                    if text:
-                        # 1. Direct string match (e.g. "1144 020 1202")
-                        if "1144 020 1202" in text:
-                            print(f"[DIRECT MATCH] Found in: {filename} (Page {i+1})")
-                            print_context(text, "1144 020 1202")
-                            found = True
-                        
-                        # 2. Flattened match (e.g. "11440201202" or "1144-020-1202")
-                        flat_text = clean_text(text)
-                        if TARGET_DIGITS in flat_text:
-                            # If we found it in flattened text but not direct, try to find the actual representation
-                            print(f"[FUZZY MATCH] Found in: {filename} (Page {i+1})")
-                            # Try to find the substring in original text that roughly matches
-                            # This is tricky, just printing a chunk of the page might be best or a regex search
-                            match = re.search(r"1144[\s\-\.]?020[\s\-\.]?1202", text)
-                            if match:
-                                print(f"  > Actual text: '{match.group(0)}'")
-                                print_context(text, match.group(0))
-                            else:
-                                print("  > (Could not extract exact string, but digits match)")
-                            found = True
-                            
-        except Exception as e:
-            print(f"Error reading {filename}: {e}")
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, MAX_WORKERS)) as pool:
+        futures = [pool.submit(search_file, filename) for filename in files]
+        for filename, future in zip(files, futures):
+            try:
+                hits = future.result()
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                continue
+            for page_no, kind, actual, context in hits:
+                print(f"[{kind} MATCH] Found in: {filename} (Page {page_no})")
+                if actual:
+                    print(f"  > Actual text: '{actual}'")
+                if context:
+                    print(context)
+                elif kind == "FUZZY":
+                    print("  > (Could not extract exact string, but digits match)")
+                found = True
 
     if not found:
         print("❌ Part number NOT found in any file.")
 
-def print_context(text, keyword):
+def get_context(text, keyword):
     idx = text.find(keyword)
     if idx != -1:
         start = max(0, idx - 50)
         end = min(len(text), idx + 100)
-        print(f"  > Context: ...{text[start:end].replace(chr(10), ' ')}...\n")
+        return f"  > Context: ...{text[start:end].replace(chr(10), ' ')}...\n"
+    return None
 
 if __name__ == "__main__":
     search_files()
@@ -0,0 +1,159 @@
+import sqlite3
+import numpy as np
+import sqlite_vec
+
+# A small Chroma-compatible collection (add / upsert / query / get / count) on top of
+# sqlite-vec, for local single-user setups where Chroma's RAM footprint hurts.
+# Chunk text + metadata live in a plain table; the vectors live in a vec0
+# virtual table that shares its rowid. Results come back in Chroma's shape
+# ({"ids": [[...]], "documents": [[...]], ...}) so callers don't care which
+# backend they're talking to.
+
+class SqliteVecCollection:
+    def __init__(self, path, name="enterprise_knowledge_base", dim=384, dtype="float32"):
+        self.name = name
+        # vec0 stores float32 or int8; float16 vectors are widened to float32
+        self.int8 = dtype == "int8"
+        self.conn = sqlite3.connect(path)
+        self.conn.enable_load_extension(True)
+        sqlite_vec.load(self.conn)
+        self.conn.enable_load_extension(False)
+
+        column = "int8" if self.int8 else "float"
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS {name}_chunks (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT,
+                source TEXT,
+                page INTEGER,
+                model TEXT
+            );
+            CREATE INDEX IF NOT EXISTS {name}_chunks_source ON {name}_chunks(source);
+            CREATE VIRTUAL TABLE IF NOT EXISTS {name}_vec USING vec0(
+                embedding {column}[{dim}] distance_metric=cosine
+            );
+        """)
+        # Stores created before the model column existed
+        columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({name}_chunks)")}
+        if "model" not in columns:
+            self.conn.execute(f"ALTER TABLE {name}_chunks ADD COLUMN model TEXT")
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_chunks_model ON {name}_chunks(model)")
+        self.conn.commit()
+
+    def _pack(self, vector):
+        return np.asarray(vector, dtype=np.int8 if self.int8 else np.float32).tobytes()
+
+    def _vec_sql(self):
+        # int8 blobs have to be tagged, otherwise vec0 reads them as float32
+        return "vec_int8(?)" if self.int8 else "?"
+
+    def count(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.name}_chunks").fetchone()[0]
+
+    def _insert(self, ids, embeddings, documents, metadatas):
+        for chunk_id, vector, doc, meta in zip(ids, embeddings, documents, metadatas):
+            cur = self.conn.execute(
+                f"INSERT INTO {self.name}_chunks (id, document, source, page, model) VALUES (?, ?, ?, ?, ?)",
+                (chunk_id, doc, meta.get("source"), meta.get("page"), meta.get("model")),
+            )
+            self.conn.execute(
+                f"INSERT INTO {self.name}_vec (rowid, embedding) VALUES (?, {self._vec_sql()})",
+                (cur.lastrowid, self._pack(vector)),
+            )
+
+    def add(self, ids, embeddings, documents, metadatas):
+        with self.conn:
+            self._insert(ids, embeddings, documents, metadatas)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        """add() that replaces chunks whose id is already stored (vec0 has no UPSERT)."""
+        with self.conn:
+            for chunk_id in ids:
+                row = self.conn.execute(f"SELECT rowid FROM {self.name}_chunks WHERE id = ?", (chunk_id,)).fetchone()
+                if row:
+                    self.conn.execute(f"DELETE FROM {self.name}_vec WHERE rowid = ?", row)
+                    self.conn.execute(f"DELETE FROM {self.name}_chunks WHERE rowid = ?", row)
+            self._insert(ids, embeddings, documents, metadatas)
+
+    @staticmethod
+    def _meta(source, page, model):
+        meta = {"source": source, "page": page}
+        if model is not None:
+            meta["model"] = model
+        return meta
+
+    def _where(self, where):
+        """(column, values) for a Chroma-style {"source" | "model": ...} filter
+        ("$eq" / "$in" or a bare value)."""
+        (column, cond), = where.items()
+        if column not in ("source", "model"):
+            raise ValueError(f"Unsupported filter field: {column}")
+        if isinstance(cond, dict):
+            return column, list(cond["$in"]) if "$in" in cond else [cond["$eq"]]
+        return column, [cond]
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for vector in query_embeddings:
+            if where:
+                # Pre-filtered: an exact scan over just the matching rows (the
+                # source / model index does the narrowing) instead of the vec0 KNN.
+                column, values = self._where(where)
+                marks = ", ".join("?" * len(values))
+                rows = self.conn.execute(
+                    f"""
+                    SELECT c.id, c.document, c.source, c.page, c.model,
+                           vec_distance_cosine(v.embedding, {self._vec_sql()}) AS distance
+                    FROM {self.name}_chunks AS c
+                    JOIN {self.name}_vec AS v ON v.rowid = c.rowid
+                    WHERE c.{column} IN ({marks})
+                    ORDER BY distance
+                    LIMIT ?
+                    """,
+                    (self._pack(vector), *values, n_results),
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    f"""
+                    SELECT c.id, c.document, c.source, c.page, c.model, v.distance
+                    FROM (
+                        SELECT rowid, distance FROM {self.name}_vec
+                        WHERE embedding MATCH {self._vec_sql()} AND k = ?
+                    ) AS v
+                    JOIN {self.name}_chunks AS c ON c.rowid = v.rowid
+                    ORDER BY v.distance
+                    """,
+                    (self._pack(vector), n_results),
+                ).fetchall()
+            results["ids"].append([r[0] for r in rows])
+            results["documents"].append([r[1] for r in rows])
+            results["metadatas"].append([self._meta(*r[2:5]) for r in rows])
+            results["distances"].append([r[5] for r in rows])
+        return results
+
+    def sources(self):
+        """Distinct sources straight off the source index, without reading any chunks."""
+        return [r[0] for r in self.conn.execute(f"SELECT DISTINCT source FROM {self.name}_chunks")]
+
+    def get(self, include=None, limit=None):
+        # Like Chroma: ids always, documents + metadatas unless include says otherwise
+        include = ["documents", "metadatas"] if include is None else include
+        columns = ["id"]
+        if "documents" in include:
+            columns.append("document")
+        if "metadatas" in include:
+            columns += ["source", "page", "model"]
+        sql = f"SELECT {', '.join(columns)} FROM {self.name}_chunks ORDER BY rowid"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        rows = self.conn.execute(sql, params).fetchall()
+
+        result = {"ids": [r[0] for r in rows]}
+        if "documents" in include:
+            result["documents"] = [r[1] for r in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._meta(*r[-3:]) for r in rows]
+        return result
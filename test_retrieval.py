@@ -1,19 +1,25 @@
-import chromadb
 import ollama
+from functools import lru_cache
+from embed_cache import quantize_embeddings, EMBEDDING_DTYPE
+from db import open_existing_collection, retrieve
 
-DB_PATH = "./chroma_db"
 EMBEDDING_MODEL = "all-minilm"
 QUERY = "I have a Stihl MS661, 177394843 serial no, but can see it running M-Tronic 3.0, I need a cylinder piston and relevant gaskets to replace a lean seized saw, give me part nos and repair instructions."
 TARGET_SOURCE = "MS 661 - Technical information - 32.2013.pdf"
 
-client = chromadb.PersistentClient(path=DB_PATH)
-collection = client.get_collection("enterprise_knowledge_base")
+@lru_cache(maxsize=1024)
+def embed_query(model, prompt):
+    """Query embeddings are memoised: repeated queries skip Ollama."""
+    return tuple(ollama.embeddings(model=model, prompt=prompt)["embedding"])
+
+collection = open_existing_collection(dtype=EMBEDDING_DTYPE)
 
 print(f"Query: {QUERY}")
 print("-" * 40)
 
-query_vec = ollama.embeddings(model=EMBEDDING_MODEL, prompt=QUERY)["embedding"]
-results = collection.query(query_embeddings=[query_vec], n_results=10)
+# Same normalisation/precision as the stored vectors (see EMBEDDING_DTYPE in embed_cache.py)
+query_vec = quantize_embeddings([embed_query(EMBEDDING_MODEL, QUERY)])[0].tolist()
+results = retrieve(QUERY, query_vec, collection, n_results=10) # Narrowed to MS 661 manuals when indexed
 
 found = False
 if results['documents'] and results['documents'][0]: